@@ -4,13 +4,23 @@ An Agentic AI Music Curator that creates perfect playlists for any vibe
 """
 
 import streamlit as st
+import gc
 import os
-import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from html import escape
+from itertools import islice
 from music_curator import MusicCurator
 from spotify_client import SpotifyClient
+from train_model import train
 import config
 
+# --- Garbage Collection ---
+# Every rerun allocates many short-lived dicts; a higher gen-0 threshold
+# avoids constant collections without disabling cyclic GC on the server.
+gc.set_threshold(50000, 10, 10)
+
 # --- Page Configuration ---
 st.set_page_config(
     page_title="🎵 Thematic Playlist Generator",
@@ -20,7 +30,9 @@ st.set_page_config(
 )
 
 # --- Custom CSS Styling ---
-st.markdown("""
+# Streamlit removes any element a rerun does not emit again, so the styles
+# and header must be sent on every run rather than once per session.
+CUSTOM_CSS = """
 <style>
     .main-header {
         text-align: center;
@@ -37,10 +49,26 @@ st.markdown("""
         margin: 0.5rem 0;
         border-left: 5px solid #1DB954;
         transition: background-color 0.3s ease;
+        display: flex;
+        align-items: center;
+        gap: 1rem;
     }
     .track-card:hover {
         background-color: #e9ecef;
     }
+    .track-number {
+        font-size: 1.5rem;
+        font-weight: bold;
+        min-width: 2rem;
+    }
+    .track-info {
+        flex: 1;
+    }
+    .track-link {
+        color: #1DB954;
+        font-weight: bold;
+        text-decoration: none;
+    }
     .ai-insight {
         background: #e8f4fd;
         padding: 1rem;
@@ -62,7 +90,76 @@ st.markdown("""
         padding: 0.75rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+HEADER_HTML = """
+<div class="main-header">
+    <h1>🎵 Thematic Playlist Generator</h1>
+    <p>Your AI Music Curator - Crafting Perfect Playlists for Any Vibe</p>
+</div>
+"""
+
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+
+
+# --- Shared Resources ---
+@st.cache_resource(show_spinner=False)
+def get_curator():
+    """Load the AI curator once per process and share it across sessions."""
+    return MusicCurator()
+
+@st.cache_resource(show_spinner=False)
+def get_spotify_client():
+    """Create a single Spotify client shared across sessions."""
+    return SpotifyClient()
+
+@st.cache_resource
+def get_executor():
+    """Thread pool for I/O that can overlap with model inference."""
+    return ThreadPoolExecutor(max_workers=2)
+
+@st.cache_resource(show_spinner=False)
+def preload_resources():
+    """Start loading the curator and Spotify client in the background, once per process."""
+    executor = get_executor()
+    return executor.submit(get_curator), executor.submit(get_spotify_client)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def model_file_exists():
+    """Check for the trained model file without a stat call on every rerun."""
+    return os.path.exists(config.MODEL_PATH)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_interpret(vibe: str):
+    """Interpret a vibe, reusing the result for vibes seen before."""
+    return get_curator().interpret_vibe(vibe)
+
+def interpretation_key(interpretation):
+    """Convert an interpretation dict into a hashable cache key."""
+    return (
+        interpretation['energy'],
+        interpretation['valence'],
+        interpretation['tempo'],
+        tuple(interpretation['primary_genres']),
+        tuple(interpretation['characteristics'])
+    )
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_suggestions(key, spotify_feedback=()):
+    """Generate song suggestions for an interpretation key, memoized."""
+    energy, valence, tempo, primary_genres, characteristics = key
+    interpretation = {
+        'primary_genres': list(primary_genres),
+        'energy': energy,
+        'valence': valence,
+        'tempo': tempo,
+        'characteristics': list(characteristics)
+    }
+    return get_curator().generate_song_suggestions(interpretation, list(spotify_feedback) or None)
+
+
+# Warm both clients while the page renders; the first get_curator() call waits for this load
+preload_resources()
 
 
 # --- Session State Initialization ---
@@ -70,7 +167,7 @@ def initialize_session_state():
     """Initialize session state variables safely."""
     if 'curator' not in st.session_state:
         try:
-            st.session_state.curator = MusicCurator()
+            st.session_state.curator = get_curator()
             st.session_state.model_loaded = True
         except Exception as e:
             st.session_state.curator = None
@@ -78,22 +175,19 @@ def initialize_session_state():
             st.session_state.model_error = e
 
     if 'spotify_client' not in st.session_state:
-        st.session_state.spotify_client = SpotifyClient()
+        st.session_state.spotify_client = get_spotify_client()
     if 'playlist_history' not in st.session_state:
-        st.session_state.playlist_history = []
+        st.session_state.playlist_history = deque(maxlen=config.MAX_HISTORY_ENTRIES)
     if 'spotify_authenticated' not in st.session_state:
         st.session_state.spotify_authenticated = False
+    if 'model_path_exists' not in st.session_state:
+        st.session_state.model_path_exists = model_file_exists()
 
 
 # --- UI Components ---
 def display_header():
     """Display the main header and title."""
-    st.markdown("""
-    <div class="main-header">
-        <h1>🎵 Thematic Playlist Generator</h1>
-        <p>Your AI Music Curator - Crafting Perfect Playlists for Any Vibe</p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(HEADER_HTML, unsafe_allow_html=True)
 
 def display_sidebar():
     """Display sidebar with information and controls."""
@@ -128,7 +222,7 @@ def display_sidebar():
 
     # Model Training Section
     st.sidebar.subheader("AI Model")
-    if os.path.exists(config.MODEL_PATH):
+    if st.session_state.model_path_exists:
         st.sidebar.success("✅ AI Model Loaded")
     else:
         st.sidebar.warning("⚠️ AI Model Not Found")
@@ -140,10 +234,43 @@ def display_sidebar():
         """)
         train_model()
 
-    # Playlist Settings
-    st.sidebar.subheader("Playlist Settings")
-    playlist_size = st.sidebar.slider("Playlist Size", 10, 50, config.DEFAULT_PLAYLIST_SIZE, 5)
-    return playlist_size
+@st.fragment
+def display_vibe_input():
+    """
+    Display the vibe input controls as a fragment so picking an example
+    reruns only this block instead of the whole app.
+    """
+    # Picking an example reruns once to prefill the text area, so it stays outside the form
+    vibe_examples = [
+        "late-night coding session", "rainy day focus", "upbeat 80s workout",
+        "morning coffee ritual", "road trip adventure", "romantic dinner",
+        "study session deep focus", "summer beach party"
+    ]
+    selected_example = st.selectbox("Or choose from examples:", [""] + vibe_examples, help="Select a pre-defined vibe to get started.")
+
+    # Vibe input form: edits don't rerun the app until the form is submitted
+    with st.form("vibe_form", border=False):
+        vibe_input = st.text_area(
+            "Enter your vibe, mood, or activity:",
+            value=selected_example,
+            height=100,
+            placeholder="e.g., 'chill Sunday morning with coffee and books' or 'intense workout motivation'"
+        )
+        playlist_size = st.slider("Playlist Size", 10, 50, config.DEFAULT_PLAYLIST_SIZE, 5)
+
+        # Generate button
+        _, col2, _ = st.columns([2, 1, 2])
+        with col2:
+            generate_button = st.form_submit_button("🎵 Generate Playlist", type="primary", use_container_width=True)
+
+    if generate_button:
+        final_vibe = vibe_input.strip()
+        if final_vibe:
+            # Generation renders outside this fragment, so hand off to a full app run
+            st.session_state.pending_playlist = (final_vibe, playlist_size)
+            st.rerun()
+        else:
+            st.warning("⚠️ Please enter a vibe description!")
 
 def display_ai_interpretation(interpretation):
     """Display AI's interpretation of the vibe in metric cards."""
@@ -156,7 +283,7 @@ def display_ai_interpretation(interpretation):
     with col2:
         st.write("**Predicted Genres:**")
         for genre in interpretation['primary_genres'][:3]:
-            st.write(f"• {genre.title()}")
+            st.write(f"• {config.GENRE_DISPLAY.get(genre) or genre.title()}")
     with col3:
         st.write("**Predicted Characteristics:**")
         for char in interpretation['characteristics'][:4]:
@@ -172,29 +299,35 @@ def display_playlist(tracks, spotify_feedback=None):
         st.write("🔄 **Collaborative AI Refinement:** Suggestions were enhanced using Spotify's catalog.")
         st.markdown('</div>', unsafe_allow_html=True)
 
+    # Render every card in a single markdown call so the browser gets one update
+    cards = []
     for i, track in enumerate(tracks, 1):
-        st.markdown('<div class="track-card">', unsafe_allow_html=True)
-        col1, col2, col3 = st.columns([1, 4, 2])
-        with col1:
-            st.write(f"### {i}")
-        with col2:
-            st.write(f"**{track['name']}**")
-            st.write(f"by {track['artist']}")
-            if track.get('source') == 'spotify_feedback':
-                st.write("🔄 *AI-Refined Suggestion*")
-        with col3:
-            if track.get('external_url'):
-                st.link_button("Play on Spotify", track['external_url'])
-            if track.get('preview_url'):
+        refined = '<br><em>🔄 AI-Refined Suggestion</em>' if track.get('source') == 'spotify_feedback' else ''
+        link = (f'<a class="track-link" href="{escape(track["external_url"])}" target="_blank">Play on Spotify</a>'
+                if track.get('external_url') else '')
+        cards.append(
+            f'<div class="track-card">'
+            f'<span class="track-number">{i}</span>'
+            f'<div class="track-info"><strong>{escape(track["name"])}</strong><br>by {escape(track["artist"])}{refined}</div>'
+            f'{link}'
+            f'</div>'
+        )
+    st.markdown("".join(cards), unsafe_allow_html=True)
+
+    # Audio previews need real widgets, so keep them out of the card HTML
+    previews = [(i, track) for i, track in enumerate(tracks, 1) if track.get('preview_url')]
+    if previews:
+        with st.expander("🎧 Previews"):
+            for i, track in previews:
+                st.caption(f"{i}. {track['name']} by {track['artist']}")
                 st.audio(track['preview_url'])
-        st.markdown('</div>', unsafe_allow_html=True)
 
 def display_playlist_history():
     """Display recent playlist generation history in expanders."""
     if st.session_state.playlist_history:
         st.subheader("📚 Playlist History")
         # Show last 5 entries in reverse chronological order
-        for entry in reversed(st.session_state.playlist_history[-5:]):
+        for entry in islice(reversed(st.session_state.playlist_history), 5):
             with st.expander(f"🎵 **Vibe:** {entry['vibe'][:50]}..."):
                 st.write(f"**Full Vibe:** {entry['vibe']}")
                 st.write(f"**Timestamp:** {entry['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}")
@@ -204,43 +337,55 @@ def display_playlist_history():
 
 # --- Core Logic ---
 def train_model():
-    """Train the AI model via an external script and reload the curator."""
+    """Train the AI model in-process and reload the curator."""
     try:
-        with st.spinner("Training AI Music Curator... This may take a few minutes."):
-            result = subprocess.run(
-                ['python', 'train_model.py'],
-                capture_output=True, text=True, check=True
-            )
-            st.success("✅ AI Model trained successfully!")
-            # Safely reload the curator instance
-            try:
-                st.session_state.curator = MusicCurator()
-                st.session_state.model_loaded = True
-                st.sidebar.success("Curator reloaded!")
-            except Exception as e:
-                st.session_state.model_loaded = False
-                st.session_state.model_error = e
-                st.error(f"Failed to reload curator after training: {e}")
-
-    except subprocess.CalledProcessError as e:
-        st.error(f"❌ Training failed with return code {e.returncode}")
-        st.code(e.stderr, language='bash')
+        progress = st.progress(0.0, text="Training AI Music Curator...")
+        train(progress_cb=progress.progress)
+        st.success("✅ AI Model trained successfully!")
+        # Safely reload the curator instance
+        try:
+            model_file_exists.clear()
+            st.session_state.model_path_exists = True
+            get_curator.clear()
+            cached_interpret.clear()
+            cached_suggestions.clear()
+            st.session_state.curator = get_curator()
+            st.session_state.model_loaded = True
+            # Reclaim the replaced models now rather than at the next threshold
+            gc.collect()
+            st.sidebar.success("Curator reloaded!")
+        except Exception as e:
+            st.session_state.model_loaded = False
+            st.session_state.model_error = e
+            st.error(f"Failed to reload curator after training: {e}")
+
     except Exception as e:
-        st.error(f"An unexpected error occurred during training: {str(e)}")
+        st.error(f"❌ Training failed: {str(e)}")
 
 def generate_playlist(vibe_description, playlist_size):
     """Orchestrate the playlist generation process."""
+    # Refresh the Spotify token in the background while the AI works
+    token_refresh = None
+    if st.session_state.spotify_authenticated:
+        token_refresh = get_executor().submit(st.session_state.spotify_client.ensure_token)
+
     # Step 1: AI interprets the vibe
     with st.spinner("🧠 AI is interpreting your vibe..."):
-        interpretation = st.session_state.curator.interpret_vibe(vibe_description)
+        interpretation = cached_interpret(vibe_description)
     display_ai_interpretation(interpretation)
 
     # Step 2: Generate initial suggestions
     with st.spinner("🎵 Curating initial song suggestions..."):
-        initial_suggestions = st.session_state.curator.generate_song_suggestions(interpretation)
+        initial_suggestions = cached_suggestions(interpretation_key(interpretation))
 
     # Step 3: Collaborate with Spotify if connected
-    if st.session_state.spotify_authenticated:
+    spotify_ready = False
+    if token_refresh is not None:
+        spotify_ready = token_refresh.result()
+        if not spotify_ready:
+            st.warning("⚠️ Could not refresh the Spotify connection. Showing AI suggestions only.")
+
+    if spotify_ready:
         with st.spinner("🔄 Collaborating with Spotify for refinement..."):
             found_tracks, spotify_feedback = st.session_state.spotify_client.validate_and_enhance_playlist(
                 initial_suggestions, num_tracks=playlist_size
@@ -249,18 +394,19 @@ def generate_playlist(vibe_description, playlist_size):
         if spotify_feedback:
             # Step 4: Refine suggestions based on Spotify's feedback
             with st.spinner("✨ Refining suggestions based on feedback..."):
-                refined_suggestions = st.session_state.curator.generate_song_suggestions(
-                    interpretation, spotify_feedback
+                refined_suggestions = cached_suggestions(
+                    interpretation_key(interpretation), tuple(spotify_feedback)
                 )
-                # Combine found tracks with newly refined suggestions
-                final_tracks = found_tracks
-                for track in refined_suggestions:
-                    if len(final_tracks) < playlist_size:
-                        final_tracks.append(track)
-                    else:
-                        break
-                # Final validation pass on the combined list
-                final_tracks, _ = st.session_state.spotify_client.validate_and_enhance_playlist(final_tracks, num_tracks=playlist_size)
+                # Base suggestions were validated above; only Spotify's feedback entries need a pass
+                remaining = playlist_size - len(found_tracks)
+                new_tracks = []
+                if remaining > 0:
+                    new_tracks, _ = st.session_state.spotify_client.validate_new_only(
+                        refined_suggestions,
+                        limit=remaining,
+                        exclude_ids={track['id'] for track in found_tracks}
+                    )
+                final_tracks = found_tracks + new_tracks
         else:
             final_tracks = found_tracks
 
@@ -279,7 +425,11 @@ def generate_playlist(vibe_description, playlist_size):
     # Save to history
     st.session_state.playlist_history.append({
         'vibe': vibe_description,
-        'interpretation': interpretation,
+        'interpretation': {
+            **interpretation,
+            'energy': float(interpretation['energy']),
+            'valence': float(interpretation['valence'])
+        },
         'timestamp': datetime.now()
     })
 
@@ -287,8 +437,8 @@ def generate_playlist(vibe_description, playlist_size):
 # --- Main Application ---
 def main():
     """Main application flow."""
-    initialize_session_state()
     display_header()
+    initialize_session_state()
 
     # Critical check: Stop the app if the model isn't loaded.
     if not st.session_state.get('model_loaded', False):
@@ -299,35 +449,15 @@ def main():
         st.stop()
 
     # --- Layout ---
-    playlist_size = display_sidebar()
+    display_sidebar()
     st.header("🎯 Describe Your Vibe")
 
-    # Vibe input form
-    vibe_examples = [
-        "late-night coding session", "rainy day focus", "upbeat 80s workout",
-        "morning coffee ritual", "road trip adventure", "romantic dinner",
-        "study session deep focus", "summer beach party"
-    ]
-    selected_example = st.selectbox("Or choose from examples:", [""] + vibe_examples, help="Select a pre-defined vibe to get started.")
-    vibe_input = st.text_area(
-        "Enter your vibe, mood, or activity:",
-        value=selected_example,
-        height=100,
-        placeholder="e.g., 'chill Sunday morning with coffee and books' or 'intense workout motivation'"
-    )
-
-    # Generate button
-    _, col2, _ = st.columns([2, 1, 2])
-    with col2:
-        generate_button = st.button("🎵 Generate Playlist", type="primary", use_container_width=True)
+    display_vibe_input()
 
     # --- Logic Execution ---
-    if generate_button:
-        final_vibe = vibe_input.strip()
-        if final_vibe:
-            generate_playlist(final_vibe, playlist_size)
-        else:
-            st.warning("⚠️ Please enter a vibe description!")
+    pending = st.session_state.pop('pending_playlist', None)
+    if pending:
+        generate_playlist(*pending)
 
     # Display history
     if st.session_state.playlist_history:
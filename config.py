@@ -1,20 +1,35 @@
 """Configuration settings for the Thematic Playlist Generator"""
 
 import os
-from typing import Dict, List
-# In spotify_client.py or config.py
+from typing import Dict, List, Optional
 import streamlit as st
 
-# No need to import a config file for these
-CLIENT_ID = st.secrets["SPOTIPY_CLIENT_ID"]
-CLIENT_SECRET = st.secrets["SPOTIPY_CLIENT_SECRET"]
-REDIRECT_URI = st.secrets["SPOTIPY_REDIRECT_URI"]
+def _credential(env_name: str, secret_name: str) -> Optional[str]:
+    """Read a credential from the environment, falling back to Streamlit secrets"""
+    value = os.getenv(env_name)
+    if value:
+        return value
+    try:
+        # Checks for secrets.toml without st.error, which would render before set_page_config
+        if not st.secrets.load_if_toml_exists():
+            return None
+        return st.secrets.get(secret_name)
+    except Exception:
+        # Malformed secrets.toml
+        return None
+
+# Spotify API Credentials
+SPOTIFY_CLIENT_ID = _credential('SPOTIFY_CLIENT_ID', 'SPOTIPY_CLIENT_ID')
+SPOTIFY_CLIENT_SECRET = _credential('SPOTIFY_CLIENT_SECRET', 'SPOTIPY_CLIENT_SECRET')
 
 # Model Configuration
 MODEL_PATH = 'trained_model.pkl'
 VECTORIZER_PATH = 'vectorizer.pkl'
 TRAINING_DATA_PATH = 'training_data.json'
 
+INTERPRET_CACHE_SIZE = 512  # Distinct vibes memoized per MusicCurator
+GENRE_TOP_K = 3  # Ranked genre hypotheses kept per vibe
+
 # Music Characteristics Mapping
 GENRE_MAPPING = {
     'electronic': ['electronic', 'techno', 'house', 'ambient', 'downtempo'],
@@ -31,6 +46,13 @@ GENRE_MAPPING = {
     'dance': ['dance', 'edm', 'house', 'trance', 'disco']
 }
 
+# Display names for genres, precomputed once instead of per rerun
+GENRE_DISPLAY = {
+    genre: genre.title()
+    for parent, genres in GENRE_MAPPING.items()
+    for genre in [parent] + genres
+}
+
 # Energy and Valence Ranges
 ENERGY_RANGES = {
     'low': (0.0, 0.3),
@@ -47,5 +69,16 @@ VALENCE_RANGES = {
 
 # Default Playlist Settings
 DEFAULT_PLAYLIST_SIZE = 20
+MAX_HISTORY_ENTRIES = 50  # Older playlist history entries are dropped
 MAX_RETRIES = 3
 SEARCH_LIMIT = 50
+AUDIO_FEATURES_BATCH_SIZE = 100  # Spotify's max ids per audio-features request
+SPOTIFY_MAX_WORKERS = 10  # Concurrent Spotify requests per validation pass
+SPOTIFY_TIMEOUT = (3.05, 10)  # Connect/read timeout in seconds per Spotify request
+
+# Spotify Search Cache
+SPOTIFY_CACHE_PATH = '.spotify_cache.sqlite'
+SPOTIFY_CACHE_TTL = 7 * 24 * 60 * 60  # 7 days
+SPOTIFY_CACHE_MAX_ROWS = 10000  # Soonest-expiring rows beyond this are dropped
+SPOTIFY_CACHE_PURGE_EVERY = 100  # Writes between purges of expired rows
+SPOTIFY_MEMO_SIZE = 4096  # Searches kept in memory per SpotifyClient
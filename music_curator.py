@@ -3,72 +3,289 @@ AI Music Curator - The heart of the Thematic Playlist Generator
 Acts as a world-class DJ and music curator
 """
 
-import pickle
+import functools
+import os
+from itertools import chain, islice
+import re
+import threading
+import joblib
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Sequence, Tuple
 import config
 
+# Vibe keywords by category; matching is substring-based, like `word in vibe`
+_CONTEXT_KEYWORDS = {
+    'focus': ("focus", "study", "work", "coding"),
+    'active': ("party", "dance", "workout"),
+    'romantic': ("romantic", "dinner", "date"),
+}
+_CONTEXT_CHARACTERISTICS = {
+    'focus': ("focus", "concentration", "minimal"),
+    'active': ("danceable", "motivational"),
+    'romantic': ("romantic", "intimate", "smooth"),
+}
+_FALLBACK_KEYWORDS = {
+    'energetic': ("energetic", "workout", "party", "upbeat"),
+    'calm': ("calm", "relax", "chill", "ambient"),
+}
+
+# Spotify feedback entries are "artist - song"; split at the first spaced dash so
+# hyphenated names (e.g. Jay-Z) and dashes inside titles survive
+_FEEDBACK_RE = re.compile(r'\s*(?P<artist>.+?)\s+-\s+(?P<song>.+?)\s*$')
+
+# Related genres per GENRE_MAPPING key, deduped once at import
+_EXPANDED = {genre: tuple(dict.fromkeys(related)) for genre, related in config.GENRE_MAPPING.items()}
+
+# Loaded model bundles keyed on (path, mtime), shared by every MusicCurator
+_MODEL_CACHE: Dict[Tuple[str, float], Dict] = {}
+_MODEL_LOCK = threading.Lock()
+
+# Seed artists per genre - a simplified stand-in for a real music database
+_GENRE_ARTISTS = {
+    'electronic': ('Daft Punk', 'Aphex Twin', 'Boards of Canada', 'Tycho'),
+    'rock': ('The Beatles', 'Led Zeppelin', 'Radiohead', 'Arctic Monkeys'),
+    'jazz': ('Miles Davis', 'John Coltrane', 'Bill Evans', 'Herbie Hancock'),
+    'ambient': ('Brian Eno', 'Stars of the Lid', 'Tim Hecker', 'Grouper'),
+    'lo-fi': ('Nujabes', 'J Dilla', 'Emancipator', 'Bonobo'),
+    'pop': ('The Weeknd', 'Billie Eilish', 'Taylor Swift', 'Dua Lipa'),
+    'hip-hop': ('Kendrick Lamar', 'J. Cole', 'Tyler, The Creator', 'Mac Miller'),
+    'indie': ('Tame Impala', 'Arctic Monkeys', 'The Strokes', 'Vampire Weekend')
+}
+
+# Song title words indexed by energy/valence quintile
+_ENERGY_WORDS = ("Slow", "Gentle", "Moderate", "Energetic", "Intense")
+_VALENCE_WORDS = ("Blue", "Calm", "Neutral", "Bright", "Euphoric")
+
+def _trie_pattern(keywords) -> str:
+    """
+    Build a regex that follows a prefix trie of the keywords, so shared
+    prefixes are matched once and the longest keyword at a position wins
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    
+    def render(node) -> str:
+        branches = [re.escape(char) + render(child) for char, child in node.items() if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # A keyword ending here makes the rest optional; greedy ? prefers the longer keyword
+        return f'(?:{body})?' if '' in node else body
+    
+    return render(trie)
+
+def _compile_keywords(groups: Dict[str, Tuple[str, ...]]):
+    """
+    Compile keyword groups into a single trie-shaped regex and a keyword -> categories map
+    A match also covers keywords it contains (e.g. 'workout' counts for the 'work' category too)
+    """
+    keywords = sorted({kw for kws in groups.values() for kw in kws})
+    # Zero-width lookahead reports a keyword at every start position, so overlapping
+    # keywords (e.g. 'romanticoding') are all found, as with the `in` checks
+    pattern = re.compile(f'(?=({_trie_pattern(keywords)}))')
+    categories = {
+        kw: frozenset(cat for cat, kws in groups.items() if any(k in kw for k in kws))
+        for kw in keywords
+    }
+    return pattern, categories
+
+def _match_categories(matcher, text: str) -> set:
+    """Return every keyword category found anywhere in text in one regex pass"""
+    pattern, categories = matcher
+    found = set()
+    for keyword in pattern.findall(text):
+        found |= categories[keyword]
+    return found
+
+_CONTEXT_MATCHER = _compile_keywords(_CONTEXT_KEYWORDS)
+_FALLBACK_MATCHER = _compile_keywords(_FALLBACK_KEYWORDS)
+
+def _load_model_bundle(path: str) -> Dict:
+    """
+    Return the model bundle at path, unpickling only if the file changed on disk
+    Concurrent callers wait on the lock for a load in progress instead of repeating it
+    """
+    key = (path, os.path.getmtime(path))
+    with _MODEL_LOCK:
+        if key not in _MODEL_CACHE:
+            models = joblib.load(path)
+            _MODEL_CACHE.clear()
+            _MODEL_CACHE[key] = models
+        return _MODEL_CACHE[key]
+
 class MusicCurator:
     """Agentic AI Music Curator"""
     
     def __init__(self):
         self.models = None
+        self.linear_heads = None
+        self.genre_classes = None
+        # Per-instance memo of interpretations, keyed on the normalized vibe
+        self._interpret_cached = functools.lru_cache(maxsize=config.INTERPRET_CACHE_SIZE)(self._interpret)
         self.load_models()
     
     def load_models(self):
         """Load trained ML models"""
         try:
-            with open(config.MODEL_PATH, 'rb') as f:
-                self.models = pickle.load(f)
+            # Shared across instances; the app warms it via preload_resources
+            self.models = _load_model_bundle(config.MODEL_PATH)
+            # Older model files only carry the fitted LabelEncoder
+            self.genre_classes = self.models.get('genre_classes')
+            if self.genre_classes is None:
+                self.genre_classes = self.models['genre_encoder'].classes_
+            self.linear_heads = self._stack_linear_heads()
             print("✅ AI Music Curator models loaded successfully!")
         except FileNotFoundError:
             print("❌ Models not found. Please run train_model.py first.")
             self.models = None
+            self.linear_heads = None
+            self.genre_classes = None
+        self._interpret_cached.cache_clear()
+    
+    def _stack_linear_heads(self):
+        """
+        Stack linear model weights into one float32 matrix so genre, energy
+        and valence come from a single sparse matmul instead of three predicts.
+        Returns None when any model is non-linear (e.g. a random forest).
+        """
+        classifier = self.models['genre_classifier']
+        regressors = self._regressors()
+        if not all(hasattr(m, 'coef_') for m in [classifier] + regressors):
+            return None
+        
+        genre_coef = np.atleast_2d(classifier.coef_)
+        weights = np.vstack([genre_coef] + [np.atleast_2d(r.coef_) for r in regressors])
+        bias = np.concatenate([np.atleast_1d(m.intercept_) for m in [classifier] + regressors])
+        return (
+            np.ascontiguousarray(weights.T, dtype=np.float32),
+            bias.astype(np.float32),
+            genre_coef.shape[0]
+        )
+    
+    def _regressors(self) -> List:
+        """Joint energy/valence regressor, or the separate pair from older model files"""
+        if 'ev_regressor' in self.models:
+            return [self.models['ev_regressor']]
+        return [self.models['energy_regressor'], self.models['valence_regressor']]
+    
+    def _predict(self, features) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Predict ranked genre names, energies and valences for every row of features
+        Genres come back as an (n_rows, k) array, most confident first
+        """
+        classifier = self.models['genre_classifier']
+        if self.linear_heads is not None:
+            weights, bias, n_genre_rows = self.linear_heads
+            # Match the float32 weights so the sparse matmul never upcasts
+            scores = np.asarray(features.astype(np.float32, copy=False) @ weights) + bias
+            genre_scores = scores[:, :n_genre_rows]
+            # Binary classifiers expose a single decision row for the positive class
+            if n_genre_rows == 1:
+                genre_scores = np.hstack([-genre_scores, genre_scores])
+            ev = scores[:, n_genre_rows:n_genre_rows + 2]
+        else:
+            if hasattr(classifier, 'predict_proba'):
+                genre_scores = classifier.predict_proba(features)
+            else:
+                genre_scores = None
+            ev = np.column_stack([r.predict(features) for r in self._regressors()])
+        
+        if genre_scores is None:
+            genre_preds = classifier.predict(features)[:, None]
+        else:
+            genre_preds = classifier.classes_[self._top_k(genre_scores, config.GENRE_TOP_K)]
+        
+        # Ensure values are in valid range
+        ev = np.clip(ev, 0.0, 1.0)
+        return self.genre_classes[genre_preds], ev[:, 0], ev[:, 1]
+    
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Column indices of the k highest scores per row, best first"""
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1)
     
     def interpret_vibe(self, vibe_description: str) -> Dict:
         """
         Interpret user's vibe description using trained AI models
         Returns predicted genres, energy, valence, and characteristics
         """
+        # Interpretation is case-insensitive, so repeats share one cache entry
+        result = self._interpret_cached(vibe_description.lower().strip())
+        return {
+            **result,
+            'primary_genres': list(result['primary_genres']),
+            'characteristics': list(result['characteristics'])
+        }
+    
+    def _interpret(self, vibe_description: str) -> Dict:
+        """
+        Uncached interpretation; list values are tuples so cached results stay immutable
+        Expects a vibe already lowercased and stripped by interpret_vibe
+        """
         if not self.models:
-            return self._fallback_interpretation(vibe_description)
+            interpretation = self._fallback_interpretation(vibe_description)
+            return {
+                **interpretation,
+                'primary_genres': tuple(interpretation['primary_genres']),
+                'characteristics': tuple(interpretation['characteristics'])
+            }
         
         # Vectorize the input
         vectorizer = self.models['vectorizer']
         features = vectorizer.transform([vibe_description])
         
-        # Predict genre
-        genre_pred = self.models['genre_classifier'].predict(features)[0]
-        genre_name = self.models['genre_encoder'].inverse_transform([genre_pred])[0]
+        top_genres, energies, valences = self._predict(features)
         
-        # Predict energy and valence
-        energy = float(self.models['energy_regressor'].predict(features)[0])
-        valence = float(self.models['valence_regressor'].predict(features)[0])
+        return self._build_interpretation(vibe_description, top_genres[0], float(energies[0]), float(valences[0]))
+    
+    def interpret_vibes_batch(self, vibes: List[str]) -> List[Dict]:
+        """
+        Interpret several vibes at once
+        Vectorizes and predicts the whole batch in one pass per model
+        """
+        if not self.models or not vibes:
+            return [self.interpret_vibe(vibe) for vibe in vibes]
         
-        # Ensure values are in valid range
-        energy = max(0.0, min(1.0, energy))
-        valence = max(0.0, min(1.0, valence))
+        vibes_lower = [vibe.lower().strip() for vibe in vibes]
+        features = self.models['vectorizer'].transform(vibes_lower)
+        top_genres, energies, valences = self._predict(features)
         
+        interpretations = []
+        for vibe, genres, energy, valence in zip(vibes_lower, top_genres, energies, valences):
+            result = self._build_interpretation(vibe, genres, float(energy), float(valence))
+            interpretations.append({
+                **result,
+                'primary_genres': list(result['primary_genres']),
+                'characteristics': list(result['characteristics'])
+            })
+        return interpretations
+    
+    def _build_interpretation(self, vibe: str, top_genres: Sequence[str], energy: float, valence: float) -> Dict:
+        """Assemble an interpretation from model predictions"""
         return {
-            'primary_genres': self._expand_genres(genre_name),
+            'primary_genres': tuple(self._expand_genres(top_genres)),
             'energy': energy,
             'valence': valence,
             'tempo': self._energy_to_tempo(energy),
-            'characteristics': self._derive_characteristics(vibe_description, energy, valence)
+            'characteristics': tuple(self._derive_characteristics(vibe, energy, valence))
         }
     
-    def _expand_genres(self, primary_genre: str) -> List[str]:
-        """Expand primary genre to related genres"""
-        genre_words = primary_genre.split()
-        expanded = []
-        
-        for word in genre_words:
-            if word in config.GENRE_MAPPING:
-                expanded.extend(config.GENRE_MAPPING[word])
-            else:
-                expanded.append(word)
-        
-        return list(set(expanded))[:5]  # Limit to 5 genres
+    def _expand_genres(self, top_genres: Sequence[str]) -> List[str]:
+        """
+        Ranked genre hypotheses first, then related genres of the most
+        confident one to fill the list
+        """
+        related = chain.from_iterable(_EXPANDED.get(word, (word,)) for word in str(top_genres[0]).split())
+        # dict keys dedupe while keeping the ranking and mapping order
+        expanded = dict.fromkeys(chain(map(str, top_genres), related))
+        return list(islice(expanded, 5))  # Limit to 5 genres
     
     def _energy_to_tempo(self, energy: float) -> str:
         """Convert energy level to tempo description"""
@@ -80,7 +297,7 @@ class MusicCurator:
             return "fast"
     
     def _derive_characteristics(self, vibe: str, energy: float, valence: float) -> List[str]:
-        """Derive musical characteristics from vibe and predicted values"""
+        """Derive musical characteristics from a lowercased vibe and predicted values"""
         characteristics = []
         
         # Energy-based characteristics
@@ -100,15 +317,12 @@ class MusicCurator:
             characteristics.extend(["neutral", "contemplative"])
         
         # Context-based characteristics
-        vibe_lower = vibe.lower()
-        if any(word in vibe_lower for word in ["focus", "study", "work", "coding"]):
-            characteristics.extend(["focus", "concentration", "minimal"])
-        if any(word in vibe_lower for word in ["party", "dance", "workout"]):
-            characteristics.extend(["danceable", "motivational"])
-        if any(word in vibe_lower for word in ["romantic", "dinner", "date"]):
-            characteristics.extend(["romantic", "intimate", "smooth"])
+        contexts = _match_categories(_CONTEXT_MATCHER, vibe)
+        for context, context_characteristics in _CONTEXT_CHARACTERISTICS.items():
+            if context in contexts:
+                characteristics.extend(context_characteristics)
         
-        return list(set(characteristics))[:6]  # Limit to 6 characteristics
+        return list(dict.fromkeys(characteristics))[:6]  # Limit to 6 characteristics
     
     def generate_song_suggestions(self, interpretation: Dict, spotify_feedback: List[str] = None) -> List[Dict]:
         """
@@ -147,20 +361,8 @@ class MusicCurator:
     
     def _get_genre_suggestions(self, genre: str, energy: float, valence: float) -> List[Dict]:
         """Get suggestions for a specific genre with energy/valence constraints"""
-        # This is a simplified version - in a real system, you'd have a larger database
-        genre_artists = {
-            'electronic': ['Daft Punk', 'Aphex Twin', 'Boards of Canada', 'Tycho'],
-            'rock': ['The Beatles', 'Led Zeppelin', 'Radiohead', 'Arctic Monkeys'],
-            'jazz': ['Miles Davis', 'John Coltrane', 'Bill Evans', 'Herbie Hancock'],
-            'ambient': ['Brian Eno', 'Stars of the Lid', 'Tim Hecker', 'Grouper'],
-            'lo-fi': ['Nujabes', 'J Dilla', 'Emancipator', 'Bonobo'],
-            'pop': ['The Weeknd', 'Billie Eilish', 'Taylor Swift', 'Dua Lipa'],
-            'hip-hop': ['Kendrick Lamar', 'J. Cole', 'Tyler, The Creator', 'Mac Miller'],
-            'indie': ['Tame Impala', 'Arctic Monkeys', 'The Strokes', 'Vampire Weekend']
-        }
-        
         suggestions = []
-        artists = genre_artists.get(genre, [f'{genre} artist'])
+        artists = _GENRE_ARTISTS.get(genre) or (f'{genre} artist',)
         
         for artist in artists[:2]:  # 2 artists per genre
             # Generate hypothetical songs with energy/valence matching
@@ -179,13 +381,10 @@ class MusicCurator:
     def _generate_song_title(self, genre: str, energy: float, valence: float) -> str:
         """Generate contextual song titles (placeholder for real song matching)"""
         # This is simplified - real implementation would use actual song databases
-        energy_words = ["Slow", "Gentle", "Moderate", "Energetic", "Intense"]
-        valence_words = ["Blue", "Calm", "Neutral", "Bright", "Euphoric"]
-        
         energy_idx = min(4, int(energy * 5))
         valence_idx = min(4, int(valence * 5))
         
-        return f"{energy_words[energy_idx]} {valence_words[valence_idx]} {genre.title()}"
+        return f"{_ENERGY_WORDS[energy_idx]} {_VALENCE_WORDS[valence_idx]} {genre.title()}"
     
     def _refine_with_spotify_feedback(self, base_suggestions: List[Dict], 
                                     spotify_feedback: List[str], 
@@ -195,21 +394,25 @@ class MusicCurator:
         When songs aren't found, use Spotify's suggestions to improve recommendations
         """
         refined_suggestions = []
+        # Fields shared by every feedback suggestion; each one copies this template
+        template = {
+            'artist': None,
+            'song': None,
+            'genre': 'spotify_suggested',
+            'energy': interpretation['energy'],
+            'valence': interpretation['valence'],
+            'confidence': 0.9,
+            'source': 'spotify_feedback'
+        }
         
         # Process Spotify feedback to extract new artists/songs
         for feedback_item in spotify_feedback:
             # Parse Spotify feedback (artist - song format)
-            if ' - ' in feedback_item:
-                artist, song = feedback_item.split(' - ', 1)
-                refined_suggestions.append({
-                    'artist': artist.strip(),
-                    'song': song.strip(),
-                    'genre': 'spotify_suggested',
-                    'energy': interpretation['energy'],
-                    'valence': interpretation['valence'],
-                    'confidence': 0.9,
-                    'source': 'spotify_feedback'
-                })
+            match = _FEEDBACK_RE.match(feedback_item)
+            if match:
+                suggestion = template.copy()
+                suggestion['artist'], suggestion['song'] = match.group('artist', 'song')
+                refined_suggestions.append(suggestion)
         
         # Combine with original suggestions, prioritizing Spotify feedback
         all_suggestions = refined_suggestions + base_suggestions
@@ -217,11 +420,11 @@ class MusicCurator:
         return all_suggestions
     
     def _fallback_interpretation(self, vibe_description: str) -> Dict:
-        """Fallback interpretation when models aren't available"""
-        vibe_lower = vibe_description.lower()
+        """Fallback interpretation from a lowercased vibe when models aren't available"""
+        moods = _match_categories(_FALLBACK_MATCHER, vibe_description)
         
         # Simple rule-based interpretation
-        if any(word in vibe_lower for word in ["energetic", "workout", "party", "upbeat"]):
+        if 'energetic' in moods:
             return {
                 'primary_genres': ['pop', 'dance', 'electronic'],
                 'energy': 0.8,
@@ -229,7 +432,7 @@ class MusicCurator:
                 'tempo': 'fast',
                 'characteristics': ['energetic', 'upbeat', 'danceable']
             }
-        elif any(word in vibe_lower for word in ["calm", "relax", "chill", "ambient"]):
+        elif 'calm' in moods:
             return {
                 'primary_genres': ['ambient', 'lo-fi', 'acoustic'],
                 'energy': 0.3,
@@ -4,83 +4,211 @@ Handles authentication, search, and playlist creation
 """
 
 import base64
+import functools
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
-from typing import List, Dict, Optional, Tuple
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from typing import Callable, Iterable, List, Dict, Optional, Tuple
 import config
 
+class SearchCache:
+    """SQLite-backed cache of Spotify search results and tokens, shared across sessions and workers"""
+    
+    def __init__(self, path: str = config.SPOTIFY_CACHE_PATH, ttl: int = config.SPOTIFY_CACHE_TTL,
+                 max_rows: int = config.SPOTIFY_CACHE_MAX_ROWS):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._writes = 0
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS search_cache "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS search_cache_expires ON search_cache (expires_at)")
+                self._purge(conn)
+        except sqlite3.Error as e:
+            print(f"⚠️ Spotify search cache disabled: {e}")
+            self.path = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+    
+    def _purge(self, conn: sqlite3.Connection):
+        """Drop expired rows, then the soonest-expiring rows beyond max_rows"""
+        conn.execute("DELETE FROM search_cache WHERE expires_at <= ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM search_cache WHERE key IN "
+            "(SELECT key FROM search_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,)
+        )
+    
+    def get(self, key: str):
+        """Return the cached value for key, or None if missing or expired"""
+        if not self.path:
+            return None
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT value FROM search_cache WHERE key = ? AND expires_at > ?",
+                    (key, time.time())
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return orjson.loads(row[0]) if row else None
+    
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        """Store value under key for ttl seconds (defaults to the cache TTL)"""
+        if not self.path:
+            return
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, orjson.dumps(value).decode(), time.time() + (self.ttl if ttl is None else ttl))
+                )
+                # Purge periodically rather than on every write
+                self._writes += 1
+                if self._writes % config.SPOTIFY_CACHE_PURGE_EVERY == 0:
+                    self._purge(conn)
+        except sqlite3.Error:
+            pass
+
 class SpotifyClient:
     """Spotify Web API Client with collaborative feedback capabilities"""
     
     def __init__(self):
         self.access_token = None
+        self.token_expires_at = 0.0
         self.base_url = "https://api.spotify.com/v1"
+        self.search_cache = SearchCache()
+        self._search_memo = functools.lru_cache(maxsize=config.SPOTIFY_MEMO_SIZE)(self._fetch_search)
+        
+        # One pooled keep-alive session for every Spotify call, with short retries on server errors.
+        # 429s are not retried: honouring Retry-After would park shared pool threads for its full length.
+        # After the last retry the final response is returned, so the usual status checks still apply.
+        self._session = requests.Session()
+        self._session.headers.update({"User-Agent": "vibelist/1.0"})
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[500, 502, 503, 504],
+                raise_on_status=False,
+                respect_retry_after_header=False
+            )
+        )
+        self._session.mount("https://", adapter)
+        
+        # Long-lived worker pool for search fan-out, sized to the connection pool
+        self._pool = ThreadPoolExecutor(max_workers=config.SPOTIFY_MAX_WORKERS)
+    
+    def _set_token(self, access_token: str, expires_at: float):
+        """Store the access token and attach it to every session request"""
+        if access_token != self.access_token:
+            # Results fetched under a previous token may be stale
+            self._search_memo.cache_clear()
+        self.access_token = access_token
+        self.token_expires_at = expires_at
+        self._session.headers["Authorization"] = f"Bearer {access_token}"
+    
+    def _token_valid(self) -> bool:
+        """Check whether the current access token is still usable"""
+        return bool(self.access_token) and time.time() < self.token_expires_at - 60
+        
+    def _request_token(self) -> int:
+        """Request a new access token, returning the HTTP status code"""
+        # Reuse a token another session or worker already fetched
+        token_key = f"token:{config.SPOTIFY_CLIENT_ID}"
+        cached = self.search_cache.get(token_key)
+        if cached:
+            self._set_token(cached["access_token"], cached["expires_at"])
+            if self._token_valid():
+                return 200
+        
+        # For demo purposes, we'll use client credentials flow
+        # In production, you'd want to use Authorization Code flow for user playlists
+        
+        auth_url = "https://accounts.spotify.com/api/token"
+        
+        # Encode client credentials
+        client_creds = f"{config.SPOTIFY_CLIENT_ID}:{config.SPOTIFY_CLIENT_SECRET}"
+        client_creds_b64 = base64.b64encode(client_creds.encode()).decode()
+        
+        headers = {
+            "Authorization": f"Basic {client_creds_b64}",
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        
+        data = {"grant_type": "client_credentials"}
+        
+        response = self._session.post(auth_url, headers=headers, data=data, timeout=config.SPOTIFY_TIMEOUT)
+        
+        if response.status_code == 200:
+            token_data = orjson.loads(response.content)
+            expires_in = token_data.get("expires_in", 3600)
+            self._set_token(token_data["access_token"], time.time() + expires_in)
+            self.search_cache.set(
+                token_key,
+                {"access_token": self.access_token, "expires_at": self.token_expires_at},
+                ttl=expires_in
+            )
+        
+        return response.status_code
         
     def authenticate(self) -> bool:
         """Authenticate with Spotify using Client Credentials flow"""
+        if self._token_valid():
+            return True
+        
+        if not config.SPOTIFY_CLIENT_ID or not config.SPOTIFY_CLIENT_SECRET:
+            st.error("Spotify credentials not configured. Set SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET.")
+            return False
+        
         try:
-            # For demo purposes, we'll use client credentials flow
-            # In production, you'd want to use Authorization Code flow for user playlists
-            
-            auth_url = "https://accounts.spotify.com/api/token"
-            
-            # Encode client credentials
-            client_creds = f"{config.SPOTIFY_CLIENT_ID}:{config.SPOTIFY_CLIENT_SECRET}"
-            client_creds_b64 = base64.b64encode(client_creds.encode()).decode()
-            
-            headers = {
-                "Authorization": f"Basic {client_creds_b64}",
-                "Content-Type": "application/x-www-form-urlencoded"
-            }
-            
-            data = {"grant_type": "client_credentials"}
-            
-            response = requests.post(auth_url, headers=headers, data=data)
-            
-            if response.status_code == 200:
-                token_data = response.json()
-                self.access_token = token_data["access_token"]
+            status_code = self._request_token()
+            if status_code == 200:
                 return True
             else:
-                st.error(f"Authentication failed: {response.status_code}")
+                st.error(f"Authentication failed: {status_code}")
                 return False
                 
         except Exception as e:
             st.error(f"Authentication error: {str(e)}")
             return False
     
+    def ensure_token(self) -> bool:
+        """
+        Refresh the access token if it has expired
+        Makes no Streamlit calls, so it can run on a background thread
+        """
+        if self._token_valid():
+            return True
+        
+        try:
+            return self._request_token() == 200
+        except Exception:
+            return False
+    
     def search_track(self, artist: str, song: str) -> Optional[Dict]:
         """Search for a specific track on Spotify"""
         if not self.access_token:
             return None
             
-        query = f"artist:{artist} track:{song}"
-        url = f"{self.base_url}/search"
-        
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-        params = {
-            "q": query,
-            "type": "track",
-            "limit": 1
-        }
-        
         try:
-            response = requests.get(url, headers=headers, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                tracks = data.get("tracks", {}).get("items", [])
-                if tracks:
-                    track = tracks[0]
-                    return {
-                        "id": track["id"],
-                        "name": track["name"],
-                        "artist": track["artists"][0]["name"],
-                        "uri": track["uri"],
-                        "external_url": track["external_urls"]["spotify"],
-                        "preview_url": track.get("preview_url"),
-                        "popularity": track["popularity"]
-                    }
-            return None
+            tracks = self._cached_search(f"artist:{artist} track:{song}", 1)
+            return tracks[0] if tracks else None
         except Exception as e:
             st.error(f"Search error: {str(e)}")
             return None
@@ -93,36 +221,10 @@ class SpotifyClient:
         if not self.access_token:
             return []
         
-        # Search by artist first
-        query = f"artist:{artist}"
-        url = f"{self.base_url}/search"
-        
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-        params = {
-            "q": query,
-            "type": "track",
-            "limit": limit
-        }
-        
         try:
-            response = requests.get(url, headers=headers, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                tracks = data.get("tracks", {}).get("items", [])
-                
-                similar_tracks = []
-                for track in tracks:
-                    similar_tracks.append({
-                        "id": track["id"],
-                        "name": track["name"],
-                        "artist": track["artists"][0]["name"],
-                        "uri": track["uri"],
-                        "external_url": track["external_urls"]["spotify"],
-                        "preview_url": track.get("preview_url"),
-                        "popularity": track["popularity"],
-                        "feedback_format": f"{track['artists'][0]['name']} - {track['name']}"
-                    })
-                
+            # Search by artist first
+            similar_tracks = self._cached_search(f"artist:{artist}", limit)
+            if similar_tracks is not None:
                 return similar_tracks
             
             # If artist search fails, try genre-based search
@@ -134,88 +236,174 @@ class SpotifyClient:
     
     def _search_by_genre(self, genre: str, limit: int = 10) -> List[Dict]:
         """Fallback search by genre"""
-        query = f"genre:{genre}"
-        url = f"{self.base_url}/search"
+        try:
+            return self._cached_search(f"genre:{genre}", limit) or []
+        except Exception as e:
+            st.error(f"Genre search error: {str(e)}")
+            
+        return []
+    
+    def _map_concurrently(self, func: Callable, items: List) -> List:
+        """
+        Run func over items on a bounded thread pool, preserving order
+        Worker threads share the script context so st.error still renders
+        """
+        ctx = get_script_run_ctx()
+        
+        def run(item):
+            add_script_run_ctx(threading.current_thread(), ctx)
+            return func(item)
+        
+        return list(self._pool.map(run, items))
+    
+    def _format_track(self, track: Dict) -> Dict:
+        """Convert a raw Spotify track object into the client's track format"""
+        return {
+            "id": track["id"],
+            "name": track["name"],
+            "artist": track["artists"][0]["name"],
+            "uri": track["uri"],
+            "external_url": track["external_urls"]["spotify"],
+            "preview_url": track.get("preview_url"),
+            "popularity": track["popularity"],
+            "feedback_format": f"{track['artists'][0]['name']} - {track['name']}"
+        }
+    
+    def _cached_search(self, query: str, limit: int) -> Optional[List[Dict]]:
+        """
+        Run a track search, serving repeats from memory, then the on-disk cache
+        Returns None if Spotify rejects the request
+        """
+        try:
+            return self._search_memo(query.lower(), limit)
+        except requests.HTTPError:
+            return None
+    
+    def _fetch_search(self, query: str, limit: int) -> List[Dict]:
+        """
+        Fetch search results from the on-disk cache or Spotify
+        Raises HTTPError on rejection so the in-memory LRU never stores failures
+        """
+        key = f"{query}|{limit}"
+        cached = self.search_cache.get(key)
+        if cached is not None:
+            return cached
         
-        headers = {"Authorization": f"Bearer {self.access_token}"}
+        url = f"{self.base_url}/search"
         params = {
             "q": query,
             "type": "track",
             "limit": limit
         }
         
+        response = self._session.get(url, params=params, timeout=config.SPOTIFY_TIMEOUT)
+        if response.status_code != 200:
+            raise requests.HTTPError(f"Search failed: {response.status_code}", response=response)
+        
+        data = orjson.loads(response.content)
+        tracks = [self._format_track(track) for track in data.get("tracks", {}).get("items", [])]
+        self.search_cache.set(key, tracks)
+        return tracks
+    
+    def _search_artist_tracks(self, artist: str) -> List[Dict]:
+        """Fetch an artist's top tracks once, shared by every suggestion for that artist"""
+        if not self.access_token:
+            return []
+        
         try:
-            response = requests.get(url, headers=headers, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                tracks = data.get("tracks", {}).get("items", [])
-                
-                genre_tracks = []
-                for track in tracks:
-                    genre_tracks.append({
-                        "id": track["id"],
-                        "name": track["name"],
-                        "artist": track["artists"][0]["name"],
-                        "uri": track["uri"],
-                        "external_url": track["external_urls"]["spotify"],
-                        "preview_url": track.get("preview_url"),
-                        "popularity": track["popularity"],
-                        "feedback_format": f"{track['artists'][0]['name']} - {track['name']}"
-                    })
-                
-                return genre_tracks
-            
+            return self._cached_search(f"artist:{artist}", config.SEARCH_LIMIT) or []
         except Exception as e:
-            st.error(f"Genre search error: {str(e)}")
-            
+            st.error(f"Artist search error: {str(e)}")
+        
         return []
     
-    def validate_and_enhance_playlist(self, suggestions: List[Dict]) -> Tuple[List[Dict], List[str]]:
+    def validate_and_enhance_playlist(self, suggestions: List[Dict],
+                                      num_tracks: Optional[int] = None,
+                                      exclude_ids: Iterable[str] = ()) -> Tuple[List[Dict], List[str]]:
         """
         Validate AI suggestions against Spotify and provide feedback
+        Issues one search per unique artist, plus one per unique genre for
+        artists Spotify returns nothing for, instead of searching per suggestion
+        Tracks in exclude_ids (e.g. already in the playlist) are never returned
         Returns: (found_tracks, spotify_feedback_for_ai)
         """
+        artists = list(dict.fromkeys(s.get('artist', '') for s in suggestions))
+        artist_tracks = dict(zip(artists, self._map_concurrently(self._search_artist_tracks, artists)))
+        
+        # Genre fallback only for artists Spotify doesn't know
+        genres = list(dict.fromkeys(
+            s.get('genre', '') for s in suggestions if not artist_tracks[s.get('artist', '')]
+        ))
+        genre_tracks = dict(zip(genres, self._map_concurrently(
+            lambda genre: self._search_by_genre(genre, limit=3), genres
+        )))
+        
         found_tracks = []
         spotify_feedback = []
+        used_ids = set(exclude_ids)
         
         for suggestion in suggestions:
-            artist = suggestion.get('artist', '')
-            song = suggestion.get('song', '')
-            genre = suggestion.get('genre', '')
-            
-            # Try to find the exact track
-            found_track = self.search_track(artist, song)
+            candidates = artist_tracks[suggestion.get('artist', '')]
+            song = suggestion.get('song', '').lower()
             
+            # Try to find the exact track among the artist's results
+            found_track = next((t for t in candidates if t['name'].lower() == song), None)
             if found_track:
-                found_tracks.append(found_track)
-            else:
-                # Track not found - get similar tracks for feedback
-                similar_tracks = self.search_similar_tracks(artist, genre, limit=3)
-                
-                if similar_tracks:
-                    # Add the best match to found tracks
-                    best_match = similar_tracks[0]
+                if found_track['id'] not in used_ids:
+                    used_ids.add(found_track['id'])
+                    if suggestion.get('source'):
+                        found_track = {**found_track, 'source': suggestion['source']}
+                    found_tracks.append(found_track)
+                continue
+            
+            # Track not found - fall back to similar tracks for feedback
+            pool = candidates or genre_tracks.get(suggestion.get('genre', ''), [])
+            if pool:
+                # Best unused match goes in the playlist, top 2 alternatives become feedback
+                best_match = next((t for t in pool if t['id'] not in used_ids), None)
+                if best_match:
+                    used_ids.add(best_match['id'])
                     found_tracks.append(best_match)
-                    
-                    # Provide feedback to AI curator
-                    for track in similar_tracks[:2]:  # Top 2 alternatives
-                        spotify_feedback.append(track['feedback_format'])
+                spotify_feedback.extend(track['feedback_format'] for track in pool[:2])
+        
+        if num_tracks is not None:
+            found_tracks = found_tracks[:num_tracks]
         
-        return found_tracks, spotify_feedback
+        return found_tracks, list(dict.fromkeys(spotify_feedback))
+    
+    def validate_new_only(self, suggestions: List[Dict], limit: Optional[int] = None,
+                          exclude_ids: Iterable[str] = ()) -> Tuple[List[Dict], List[str]]:
+        """
+        Validate only the feedback-derived entries of refined suggestions
+        The base suggestions in that list were already validated in the first pass,
+        so searching them again would only pick different filler tracks
+        Returns up to limit tracks not already in exclude_ids
+        """
+        new_suggestions = [s for s in suggestions if s.get('source') == 'spotify_feedback']
+        return self.validate_and_enhance_playlist(new_suggestions, num_tracks=limit, exclude_ids=exclude_ids)
     
     def get_track_features(self, track_ids: List[str]) -> List[Dict]:
-        """Get audio features for tracks (energy, valence, etc.)"""
+        """
+        Get audio features for tracks (energy, valence, etc.)
+        Requests ids in batches of up to AUDIO_FEATURES_BATCH_SIZE, fetched concurrently
+        """
         if not self.access_token or not track_ids:
             return []
         
+        size = config.AUDIO_FEATURES_BATCH_SIZE
+        batches = [track_ids[i:i + size] for i in range(0, len(track_ids), size)]
+        results = self._map_concurrently(self._fetch_features_batch, batches)
+        return [features for batch in results for features in batch]
+    
+    def _fetch_features_batch(self, track_ids: List[str]) -> List[Dict]:
+        """Fetch audio features for a single batch of track ids"""
         url = f"{self.base_url}/audio-features"
-        headers = {"Authorization": f"Bearer {self.access_token}"}
         params = {"ids": ",".join(track_ids)}
         
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = self._session.get(url, params=params, timeout=config.SPOTIFY_TIMEOUT)
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 return data.get("audio_features", [])
         except Exception as e:
             st.error(f"Audio features error: {str(e)}")
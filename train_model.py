@@ -2,11 +2,12 @@
 Training script for the Thematic Playlist Generator AI model
 """
 
-import json
-import pickle
+import orjson
+import joblib
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.linear_model import LogisticRegression, Ridge
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score
 from sklearn.preprocessing import LabelEncoder
@@ -14,8 +15,8 @@ import config
 
 def load_training_data():
     """Load and preprocess training data"""
-    with open(config.TRAINING_DATA_PATH, 'r') as f:
-        data = json.load(f)
+    with open(config.TRAINING_DATA_PATH, 'rb') as f:
+        data = orjson.loads(f.read())
     
     # Extract features and labels
     vibes = []
@@ -40,14 +41,19 @@ def create_features(vibes, characteristics):
     # Combine vibe descriptions with characteristics
     combined_text = [f"{vibe} {char}" for vibe, char in zip(vibes, characteristics)]
     
-    # Create TF-IDF vectorizer
-    vectorizer = TfidfVectorizer(
-        max_features=100,  # Very small for tiny dataset
-        ngram_range=(1, 1),  # Only unigrams for small dataset
-        stop_words='english',
-        lowercase=True,
-        min_df=1  # Important for small datasets
-    )
+    # Hashed term counts re-weighted by TF-IDF: no vocabulary dict to pickle or look up
+    vectorizer = Pipeline([
+        ('hashing', HashingVectorizer(
+            n_features=1024,  # Fixed width, small enough for the stacked linear heads
+            ngram_range=(1, 1),  # Only unigrams for small dataset
+            stop_words='english',
+            lowercase=True,
+            alternate_sign=False,  # Keep counts non-negative for the IDF weighting
+            norm=None,  # TfidfTransformer normalizes after weighting
+            dtype=np.float32  # Half the bytes per feature; the IDF weights inherit it
+        )),
+        ('tfidf', TfidfTransformer())
+    ])
     
     # Fit and transform the text data
     features = vectorizer.fit_transform(combined_text)
@@ -77,14 +83,9 @@ def train_genre_classifier(features, genres):
     # Use shape[0] for sparse matrices
     print(f"Training samples: {X_train.shape[0]}, Test samples: {X_test.shape[0]}")
     
-    # Train Random Forest classifier with minimal settings for small datasets
-    classifier = RandomForestClassifier(
-        n_estimators=10,  # Very small for tiny dataset
-        random_state=42,
-        max_depth=3,  # Shallow to prevent overfitting
-        min_samples_split=2,
-        min_samples_leaf=1
-    )
+    # L2-regularized linear classifier: steadier than a forest on tiny datasets,
+    # and prediction is a single sparse dot product
+    classifier = LogisticRegression(C=1.0, solver='liblinear')
     classifier.fit(X_train, y_train)
     
     # Evaluate model only if we have test samples
@@ -105,9 +106,8 @@ def train_genre_classifier(features, genres):
     
     return classifier, label_encoder
 
-def train_energy_valence_regressors(features, energy_levels, valence_levels):
-    """Train regressors for energy and valence prediction"""
-    from sklearn.ensemble import RandomForestRegressor
+def train_energy_valence_regressor(features, energy_levels, valence_levels):
+    """Train one multi-output regressor predicting [energy, valence]"""
     from sklearn.metrics import mean_squared_error, r2_score
     
     # For small datasets, use simple split
@@ -116,36 +116,23 @@ def train_energy_valence_regressors(features, energy_levels, valence_levels):
     else:
         test_size = 0.2
     
-    # Split data
-    X_train, X_test, y_energy_train, y_energy_test = train_test_split(
-        features, energy_levels, test_size=test_size, random_state=42
-    )
-    _, _, y_valence_train, y_valence_test = train_test_split(
-        features, valence_levels, test_size=test_size, random_state=42
+    # Split once on the stacked targets so energy and valence share rows
+    Y = np.column_stack([energy_levels, valence_levels])
+    X_train, X_test, Y_train, Y_test = train_test_split(
+        features, Y, test_size=test_size, random_state=42
     )
+    y_energy_test, y_valence_test = Y_test[:, 0], Y_test[:, 1]
     
     print(f"Regression training samples: {X_train.shape[0]}, test samples: {X_test.shape[0]}")
     
-    # Train energy regressor
-    energy_regressor = RandomForestRegressor(
-        n_estimators=10, 
-        random_state=42,
-        max_depth=3
-    )
-    energy_regressor.fit(X_train, y_energy_train)
-    
-    # Train valence regressor
-    valence_regressor = RandomForestRegressor(
-        n_estimators=10, 
-        random_state=42,
-        max_depth=3
-    )
-    valence_regressor.fit(X_train, y_valence_train)
+    # Ridge fits both targets at once (lsqr handles sparse TF-IDF input with an intercept)
+    ev_regressor = Ridge(alpha=1.0, solver='lsqr')
+    ev_regressor.fit(X_train, Y_train)
     
-    # Evaluate models
+    # Evaluate model
     if X_test.shape[0] > 0:
-        energy_pred = energy_regressor.predict(X_test)
-        valence_pred = valence_regressor.predict(X_test)
+        ev_pred = ev_regressor.predict(X_test)
+        energy_pred, valence_pred = ev_pred[:, 0], ev_pred[:, 1]
         
         try:
             energy_r2 = r2_score(y_energy_test, energy_pred)
@@ -161,45 +148,63 @@ def train_energy_valence_regressors(features, energy_levels, valence_levels):
     else:
         print("No test samples for regression evaluation")
     
-    return energy_regressor, valence_regressor
+    return ev_regressor
 
-def save_models(vectorizer, genre_classifier, genre_encoder, energy_regressor, valence_regressor):
+def save_models(vectorizer, genre_classifier, genre_encoder, ev_regressor):
     """Save all trained models"""
     model_data = {
         'vectorizer': vectorizer,
         'genre_classifier': genre_classifier,
-        'genre_encoder': genre_encoder,
-        'energy_regressor': energy_regressor,
-        'valence_regressor': valence_regressor
+        # Plain array of class names, indexed directly by encoded predictions
+        'genre_classes': genre_encoder.classes_,
+        'ev_regressor': ev_regressor
     }
     
-    with open(config.MODEL_PATH, 'wb') as f:
-        pickle.dump(model_data, f)
+    # Compressed joblib bundle; MusicCurator loads it with joblib.load
+    joblib.dump(model_data, config.MODEL_PATH, compress=3)
     
     print(f"\nModels saved to {config.MODEL_PATH}")
+    return model_data
 
-def main():
-    """Main training pipeline"""
-    print("Loading training data...")
+def train(progress_cb=None):
+    """
+    Run the training pipeline in-process and save the models
+    progress_cb, if given, is called with (fraction_done, message) before each stage
+    """
+    def report(fraction, message):
+        print(message)
+        if progress_cb:
+            progress_cb(fraction, message)
+    
+    report(0.0, "Loading training data...")
     vibes, genres, energy_levels, valence_levels, characteristics = load_training_data()
     
     print(f"Loaded {len(vibes)} training examples")
     print(f"Unique genres: {set(genres)}")
     
-    print("Creating features...")
+    report(0.2, "Creating features...")
     features, vectorizer = create_features(vibes, characteristics)
     print(f"Feature matrix shape: {features.shape}")
     
-    print("Training genre classifier...")
+    report(0.4, "Training genre classifier...")
     genre_classifier, genre_encoder = train_genre_classifier(features, genres)
     
-    print("Training energy and valence regressors...")
-    energy_regressor, valence_regressor = train_energy_valence_regressors(
-        features, energy_levels, valence_levels
-    )
+    report(0.6, "Training energy and valence regressor...")
+    ev_regressor = train_energy_valence_regressor(features, energy_levels, valence_levels)
+    
+    report(0.8, "Saving models...")
+    model_data = save_models(vectorizer, genre_classifier, genre_encoder, ev_regressor)
     
-    print("Saving models...")
-    save_models(vectorizer, genre_classifier, genre_encoder, energy_regressor, valence_regressor)
+    report(1.0, "Training completed!")
+    return model_data
+
+def main():
+    """Main training pipeline"""
+    model_data = train()
+    vectorizer = model_data['vectorizer']
+    genre_classifier = model_data['genre_classifier']
+    genre_classes = model_data['genre_classes']
+    ev_regressor = model_data['ev_regressor']
     
     print("\n✅ Training completed successfully!")
     print("You can now run the Streamlit app with: streamlit run app.py")
@@ -212,14 +217,15 @@ def main():
         "romantic dinner atmosphere"
     ]
     
-    for test_vibe in test_vibes:
-        test_features = vectorizer.transform([test_vibe])
-        
-        predicted_genre_idx = genre_classifier.predict(test_features)[0]
-        predicted_genre = genre_encoder.inverse_transform([predicted_genre_idx])[0]
-        predicted_energy = energy_regressor.predict(test_features)[0]
-        predicted_valence = valence_regressor.predict(test_features)[0]
-        
+    # Predict the whole batch in one call per model
+    test_features = vectorizer.transform(test_vibes)
+    predicted_genres = genre_classes[genre_classifier.predict(test_features)]
+    predicted_ev = ev_regressor.predict(test_features)
+    predicted_energies, predicted_valences = predicted_ev[:, 0], predicted_ev[:, 1]
+    
+    for test_vibe, predicted_genre, predicted_energy, predicted_valence in zip(
+        test_vibes, predicted_genres, predicted_energies, predicted_valences
+    ):
         print(f"\nTest: '{test_vibe}'")
         print(f"  → Genre: {predicted_genre}")
         print(f"  → Energy: {predicted_energy:.3f}")